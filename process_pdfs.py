@@ -1,82 +1,169 @@
 import fitz  # PyMuPDF
 import json
+import numpy as np
 import os
 import re
-from collections import Counter, defaultdict
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+
+try:
+    import orjson
+except ImportError:  # Optional: fall back to the stdlib json writer
+    orjson = None
+
+# Default "dict" extraction flags minus image blocks, which we never read
+TEXT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
+# Patterns used per line, compiled once
+_TOC_RE = re.compile(r'\s*\.{3,}\s*\d+\s*$')
+_BULLET_RE = re.compile(r'^[•-]')
+_HEADING_NUM_RE = re.compile(r'^((\d{1,2}(\.\d{1,2})*)|(Appendix|Chapter)\s+[A-Z0-9\s:]|([IVXLCDM]+\.))')
+
+# Font name -> is it a bold face. Documents use only a handful of distinct fonts.
+_font_is_bold = {}
 
 # --- Utility Functions ---
 
 def clean_text(text):
     """Cleans text by removing excessive whitespace and common TOC artifacts."""
-    text = re.sub(r'\s+', ' ', text).strip()
+    text = " ".join(text.split())
     # Remove page number artifacts like '........... 12'
-    text = re.sub(r'\s*\.{3,}\s*\d+\s*$', '', text)
+    text = _TOC_RE.sub('', text)
     return text
 
-def is_likely_footer_or_header(line, page, all_lines_by_page):
+def is_bold_font(font):
+    """Memoized check for 'bold' in a font name."""
+    is_bold = _font_is_bold.get(font)
+    if is_bold is None:
+        is_bold = _font_is_bold[font] = 'bold' in font.lower()
+    return is_bold
+
+def mode(items):
+    """
+    Returns the most common item in a single counting pass. Ties go to the
+    item seen first, same as Counter.most_common(1).
+    """
+    counts = {}
+    for item in items:
+        counts[item] = counts.get(item, 0) + 1
+    return max(counts.items(), key=itemgetter(1))[0]
+
+def read_line_spans(spans):
+    """
+    Joins a line's span texts and finds its dominant (size, font) style
+    in a single pass over the spans.
+    """
+    if len(spans) == 1:
+        span = spans[0]
+        return span['text'], (round(span['size']), span['font'])
+
+    texts = []
+    counts = {}
+    for span in spans:
+        texts.append(span['text'])
+        style = (round(span['size']), span['font'])
+        counts[style] = counts.get(style, 0) + 1
+    if not counts:
+        return "", None
+    # Inlined mode(): max() keeps the first style seen on ties
+    return " ".join(texts), max(counts.items(), key=itemgetter(1))[0]
+
+def position_key(text, y_pos):
+    """
+    Key for the header/footer position index: the text plus a 10pt-wide
+    vertical bucket. Lines within 10pt of each other always land in the
+    same or an adjacent bucket.
+    """
+    return (text, int(y_pos // 10))
+
+def is_in_header_footer_band(y_pos, page_height):
+    """Headers are at the top, footers at the bottom of a page."""
+    return y_pos < page_height * 0.1 or y_pos > page_height * 0.9
+
+def is_header_footer(text, y_pos, page_num, position_index):
     """
     Heuristic to detect if a line is a repeating header or footer.
-    Checks if similar text appears in a similar vertical position on other pages.
+    Checks if the same text appears in a similar vertical position on other pages.
+    Only meaningful for lines inside the header/footer band.
     """
-    y_pos = line['bbox'].y0
-    text = line['text']
-    
-    # Headers are at the top, footers at the bottom of a page
-    page_height = page.rect.height
-    if y_pos < page_height * 0.1 or y_pos > page_height * 0.9:
-        # Check for repetition across other pages
-        match_count = 0
-        for p_num, p_lines in all_lines_by_page.items():
-            if p_num == page.number:
-                continue
-            for other_line in p_lines:
-                # If text is similar and y-position is close, it's a repeater
-                if text == other_line['text'] and abs(y_pos - other_line['bbox'].y0) < 10:
-                    match_count += 1
-                    break # Move to next page
-        # If it appears on at least one other page, it's likely a header/footer
-        if match_count > 0:
-            return True
+    text, bucket = position_key(text, y_pos)
+    # A match within 10pt can straddle a bucket edge, so check the neighbours too
+    for b in (bucket - 1, bucket, bucket + 1):
+        for other_page, other_y_pos in position_index.get((text, b), ()):
+            # If it appears on at least one other page, it's likely a header/footer
+            if other_page != page_num and abs(y_pos - other_y_pos) < 10:
+                return True
     return False
 
+def to_line_columns(lines):
+    """
+    Converts line records into parallel per-field columns (struct-of-arrays),
+    so scoring indexes by line position instead of through per-line dicts.
+    """
+    return {
+        'text': [l['text'] for l in lines],
+        'size': np.array([l['style'][0] for l in lines], dtype=np.int16),
+        'font': [l['style'][1] for l in lines],
+        'page_num': np.array([l['page_num'] for l in lines], dtype=np.int32),
+        'y0': np.array([l['y0'] for l in lines], dtype=np.float32),
+        'x0': np.array([l['x0'] for l in lines], dtype=np.float32),
+        'word_count': np.array([l['word_count'] for l in lines], dtype=np.int32),
+        'is_upper': np.array([l['is_upper'] for l in lines], dtype=bool),
+        'is_bold': np.array([is_bold_font(l['style'][1]) for l in lines], dtype=bool),
+    }
+
 # --- Stage 1: Logical Line and Document Structure Extraction ---
 
 def get_document_lines_and_features(pdf_path):
     """
     Extracts all lines from a PDF, detects headers/footers, and pre-computes
-    document-wide features like body text style.
+    document-wide features like body text style. Lines are returned as
+    columns (see to_line_columns).
     """
-    doc = fitz.open(pdf_path)
     all_lines = []
-    raw_lines_by_page = defaultdict(list)
+    # Maps (text, y bucket) to the (page_num, y0) of every line with that key
+    position_index = defaultdict(list)
+    # Minimal per-line tuples: (text, style, page_num, x0, y0, candidate_hf)
+    raw_lines = []
     
-    # First pass: Extract raw lines and group by page
-    for page_num, page in enumerate(doc):
-        page_dict = page.get_text("dict", sort=True)
-        for block in page_dict.get("blocks", []):
-            if block['type'] == 0:  # Text block
-                for line in block.get("lines", []):
-                    line_text = " ".join(span['text'] for span in line['spans'])
-                    if not line_text.strip():
-                        continue
-                    
-                    styles = [(round(span['size']), span['font']) for span in line['spans']]
-                    if not styles: continue
-                    dominant_style = Counter(styles).most_common(1)[0][0]
-                    
-                    raw_lines_by_page[page_num].append({
-                        "text": line_text, "style": dominant_style,
-                        "page_num": page_num, "bbox": fitz.Rect(line['bbox'])
-                    })
-
-    # Second pass: Clean, filter headers/footers, and create final line list
-    for page_num, page in enumerate(doc):
-        lines_on_page = raw_lines_by_page[page_num]
-        for line_data in lines_on_page:
-            if not is_likely_footer_or_header(line_data, page, raw_lines_by_page):
-                line_data['text'] = clean_text(line_data['text'])
-                if line_data['text']:
-                    all_lines.append(line_data)
+    # Pass 1: stream the pages once, keeping only small tuples and the position index.
+    # Each page's text dict is dropped as soon as the iterator moves on.
+    with fitz.open(pdf_path, filetype="pdf") as doc:
+        for page in doc.pages():
+            page_num = page.number
+            page_height = page.rect.height
+            # sort=True is a cheap Python-side sort of the (text-only) blocks, and the
+            # resulting reading order is load-bearing: heading scoring compares each
+            # line with its neighbours, so the final outline sort cannot replace it.
+            page_dict = page.get_text("dict", flags=TEXT_FLAGS, sort=True)
+            for block in page_dict.get("blocks", []):
+                if block['type'] == 0:  # Text block
+                    for line in block.get("lines", []):
+                        line_text, dominant_style = read_line_spans(line['spans'])
+                        if not line_text.strip():
+                            continue
+                        
+                        x0, y0 = line['bbox'][0], line['bbox'][1]
+                        position_index[position_key(line_text, y0)].append((page_num, y0))
+                        raw_lines.append((
+                            line_text, dominant_style, page_num, x0, y0,
+                            is_in_header_footer_band(y0, page_height)
+                        ))
+
+    # Pass 2 (no page access): filter headers/footers, clean, and build full records
+    for line_text, style, page_num, x0, y0, candidate_hf in raw_lines:
+        # Mid-page lines can never be headers/footers; skip the index lookup
+        if candidate_hf and is_header_footer(line_text, y0, page_num, position_index):
+            continue
+        text = clean_text(line_text)
+        if text:
+            all_lines.append({
+                "text": text, "style": style, "page_num": page_num, "x0": x0, "y0": y0,
+                # Cleaned text is single-spaced, so this matches len(text.split())
+                "word_count": text.count(' ') + 1,
+                "is_upper": text.isupper()
+            })
 
     # Determine document-wide features
     doc_features = {
@@ -86,12 +173,12 @@ def get_document_lines_and_features(pdf_path):
     # A more robust way to find body text: not all caps, has several words.
     body_styles = [
         l['style'] for l in all_lines 
-        if 5 < len(l['text'].split()) < 20 and not l['text'].isupper()
+        if 5 < l['word_count'] < 20 and not l['is_upper']
     ]
     if body_styles:
-        doc_features['body_size'], doc_features['body_font'] = Counter(body_styles).most_common(1)[0][0]
+        doc_features['body_size'], doc_features['body_font'] = mode(body_styles)
 
-    return all_lines, doc_features
+    return to_line_columns(all_lines), doc_features
 
 
 # --- Stage 2: Feature-Based Scoring and Hierarchy Analysis ---
@@ -101,66 +188,68 @@ def analyze_document_structure(lines, doc_features):
     Analyzes all lines to find the title and build a hierarchical outline
     using a more robust, feature-based scoring model.
     """
-    if not lines:
+    texts, sizes, fonts = lines['text'], lines['size'], lines['font']
+    page_nums, y0s = lines['page_num'], lines['y0']
+    if not texts:
         return "", []
 
     # --- Score every line as a potential heading ---
-    scored_lines = []
-    for i, line in enumerate(lines):
-        score, is_title_candidate = score_line_as_heading(line, doc_features, lines, i)
-        if score > 3.0:  # Increased threshold to be more selective
-            scored_lines.append({'line': line, 'score': score, 'is_title_candidate': is_title_candidate})
+    body_size = doc_features['body_size']
+    scores, title_candidate_mask = score_lines_as_headings(lines, body_size)
+    is_scored = scores > 3.0  # Increased threshold to be more selective
 
-    if not scored_lines:
+    if not is_scored.any():
         return find_fallback_title(lines), []
 
     # --- Identify the Title ---
     # The best title candidate is one with a high score that is marked as a title candidate
-    title_candidates = [sl for sl in scored_lines if sl['is_title_candidate']]
-    if not title_candidates:
+    title_candidates = np.flatnonzero(is_scored & title_candidate_mask)
+    if not title_candidates.size:
         # If no explicit title candidates, use the highest scored item on the first page
-        title_candidates = [sl for sl in scored_lines if sl['line']['page_num'] == 0]
+        title_candidates = np.flatnonzero(is_scored & (page_nums == 0))
 
-    if title_candidates:
-        title_sl = max(title_candidates, key=lambda x: x['score'])
-        title_text = title_sl['line']['text']
+    outline_mask = is_scored.copy()
+    if title_candidates.size:
+        # argmax keeps the first of equal scores, like max() did
+        title_index = title_candidates[np.argmax(scores[title_candidates])]
+        title_text = texts[title_index]
         # Remove the identified title from the list of outline candidates
-        outline_candidates = [sl for sl in scored_lines if sl['line'] != title_sl['line']]
+        outline_mask[title_index] = False
     else: # Fallback if no suitable candidates found
         title_text = find_fallback_title(lines)
-        outline_candidates = scored_lines
 
+    outline_candidates = np.flatnonzero(outline_mask).tolist()
     if not outline_candidates:
         return title_text, []
         
     # --- Assign Hierarchy Levels (H1, H2, H3) ---
     # We group candidates by their style (font size and name) and rank these styles.
     # This is more stable than clustering on a single score value.
-    style_groups = defaultdict(list)
-    for sl in outline_candidates:
-        style_groups[sl['line']['style']].append(sl)
+    candidate_styles = [(int(sizes[i]), fonts[i]) for i in outline_candidates]
+    # Only the small set of distinct styles needs ranking; dict.fromkeys keeps
+    # first-seen order so equally ranked styles keep a stable order.
+    unique_styles = dict.fromkeys(candidate_styles)
 
     # Rank styles by size, then boldness. This defines the hierarchy.
     # e.g., (16, 'Bold') > (14, 'Bold') > (14, 'Normal')
-    sorted_styles = sorted(style_groups.keys(), key=lambda s: (s[0], 'bold' in s[1].lower()), reverse=True)
+    sorted_styles = sorted(unique_styles, key=lambda s: (s[0], is_bold_font(s[1])), reverse=True)
     
     level_map = {style: f"H{i+1}" for i, style in enumerate(sorted_styles[:3])}
 
     outline = []
-    for sl in outline_candidates:
-        style = sl['line']['style']
+    for i, style in zip(outline_candidates, candidate_styles):
         if style in level_map:
             outline.append({
                 "level": level_map[style],
-                "text": sl['line']['text'],
-                "page": sl['line']['page_num'] + 1,
+                "text": texts[i],
+                "page": int(page_nums[i]) + 1,
                 # Store position for final sorting
-                "y_pos": sl['line']['bbox'].y0
+                "y_pos": float(y0s[i])
             })
             
     # --- Final Sort and Logical Refinement ---
     # Sort by page, then by vertical position on the page. THIS IS CRITICAL.
-    outline.sort(key=lambda x: (x['page'], x['y_pos']))
+    outline.sort(key=itemgetter('page', 'y_pos'))
     
     # Remove the temporary y_pos key before final output
     for item in outline:
@@ -174,73 +263,100 @@ def analyze_document_structure(lines, doc_features):
 
 def find_fallback_title(lines):
     """If scoring fails, find the most prominent text on the first page."""
-    first_page_lines = [l for l in lines if l['page_num'] == 0]
-    if not first_page_lines: return "Untitled Document"
+    first_page = np.flatnonzero(lines['page_num'] == 0)
+    if not first_page.size: return "Untitled Document"
     # The title is likely the line with the largest font on the first page.
-    return max(first_page_lines, key=lambda l: l['style'][0])['text']
+    return lines['text'][first_page[np.argmax(lines['size'][first_page])]]
+
+def is_rejected_as_heading(text, word_count):
+    """Strong rejections: patterns that rule a line out as a heading outright."""
+    if word_count > 15: return True # Too long for a heading
+    if word_count == 0: return True
+    if text.endswith('.') and word_count > 3: return True # It's a full sentence
+    if _BULLET_RE.match(text): return True # It's a bullet point
+    if not any(char.isalpha() for char in text): return True # No letters (e.g., '---')
+    if word_count == 1 and len(text) > 25: return True # Likely a URL or garbage
+    return False
 
-def score_line_as_heading(line, features, all_lines, index):
+def score_lines_as_headings(lines, body_size):
     """
     A much more robust scoring function with heavy penalties for non-heading patterns.
-    Returns (score, is_title_candidate_flag).
+    String checks run once per line to build masks; everything numeric is
+    left to score_numeric.
+    Returns (scores, is_title_candidate) arrays aligned with the line columns.
+    """
+    texts, fonts = lines['text'], lines['font']
+    n = len(texts)
+
+    # --- Per-line string checks ---
+    rejected = np.fromiter(
+        (is_rejected_as_heading(t, wc) for t, wc in zip(texts, lines['word_count'].tolist())),
+        dtype=bool, count=n
+    )
+    numbering_mask = np.fromiter((bool(_HEADING_NUM_RE.match(t)) for t in texts), dtype=bool, count=n)
+    font_codes = {}
+    font_ids = np.fromiter((font_codes.setdefault(f, len(font_codes)) for f in fonts), dtype=np.int32, count=n)
+
+    # If no numbering, it has a higher chance of being a title
+    is_title_candidate = ~numbering_mask & ~rejected
+
+    scores = score_numeric(
+        lines['size'].astype(np.float64), font_ids, lines['is_bold'], lines['is_upper'],
+        lines['word_count'], lines['page_num'], numbering_mask, is_title_candidate,
+        body_size, body_size + 1
+    )
+    scores[rejected] = 0.0
+    return scores, is_title_candidate
+
+def score_numeric(sizes, font_ids, is_bold, is_upper, word_counts, page_nums,
+                  numbering_mask, is_title_candidate, body_size, body_size_threshold):
+    """
+    Numeric core of heading scoring. Takes only arrays and scalars, so the
+    whole pass runs as a handful of NumPy array operations.
     """
-    text, style, bbox = line['text'], line['style'], line['bbox']
-    size, font = style
-    
-    # --- Initial Feature Checks (Strong Rejections) ---
-    words = text.split()
-    word_count = len(words)
-    if word_count > 15: return 0.0, False # Too long for a heading
-    if word_count == 0: return 0.0, False
-    if text.endswith('.') and word_count > 3: return 0.0, False # It's a full sentence
-    if re.match(r'^[•-]', text): return 0.0, False # It's a bullet point
-    if not any(char.isalpha() for char in text): return 0.0, False # No letters (e.g., '---')
-    if word_count == 1 and len(text) > 25: return 0.0, False # Likely a URL or garbage
-    
-    score = 0.0
-    is_title_candidate = False
-
     # --- Positive Scoring ---
     # 1. Font Size relative to body text is a strong signal
-    if size > features['body_size'] + 1:
-        score += (size - features['body_size']) * 2.0
+    scores = np.where(sizes > body_size_threshold, (sizes - body_size) * 2.0, 0.0)
 
     # 2. Font Weight
-    if 'bold' in font.lower():
-        score += 4.0
+    scores += np.where(is_bold, 4.0, 0.0)
 
     # 3. All Caps (less important than size/weight)
-    if text.isupper() and word_count > 1:
-        score += 1.5
+    scores += np.where(is_upper & (word_counts > 1), 1.5, 0.0)
 
     # 4. Numbering (VERY strong signal for outline headings)
-    if re.match(r'^((\d{1,2}(\.\d{1,2})*)|(Appendix|Chapter)\s+[A-Z0-9\s:]|([IVXLCDM]+\.))', text):
-        score += 8.0
-    else:
-        # If no numbering, it has a higher chance of being a title
-        is_title_candidate = True
+    scores += np.where(numbering_mask, 8.0, 0.0)
 
     # 5. Position on Page (Top of page is good)
-    prev_line = all_lines[index - 1] if index > 0 else None
-    if prev_line and line['page_num'] != prev_line['page_num']:
-        # This is the first line on a new page
-        score += 2.0
+    # The first line on a new page
+    scores[1:] += np.where(page_nums[1:] != page_nums[:-1], 2.0, 0.0)
 
     # --- Contextual Penalties ---
     # Penalize if it looks like part of a paragraph (same style as lines around it)
-    next_line = all_lines[index + 1] if index < len(all_lines) - 1 else None
-    if prev_line and next_line and prev_line['style'] == style == next_line['style']:
-        score *= 0.3 # Less likely to be a heading if surrounded by same-style text
-        
+    if len(scores) > 2:
+        same_style_around = (
+            (sizes[:-2] == sizes[1:-1]) & (sizes[1:-1] == sizes[2:])
+            & (font_ids[:-2] == font_ids[1:-1]) & (font_ids[1:-1] == font_ids[2:])
+        )
+        scores[1:-1] *= np.where(same_style_around, 0.3, 1.0) # Less likely to be a heading if surrounded by same-style text
+
     # Title-specific Boost
-    if is_title_candidate and line['page_num'] == 0:
-        score *= 1.5 # Boost title candidates on first page
-        
-    return score, is_title_candidate
+    scores *= np.where(is_title_candidate & (page_nums == 0), 1.5, 1.0) # Boost title candidates on first page
+
+    return scores
 
 
 # --- Main Orchestration ---
 
+def write_json(output_path, result):
+    """Writes a result as UTF-8 JSON, using orjson when it is installed."""
+    if orjson is not None:
+        with open(output_path, 'wb') as f:
+            f.write(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+    else:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
 def process_pdf(pdf_path):
     """Main orchestrator."""
     print(f"Processing {os.path.basename(pdf_path)}...")
@@ -272,14 +388,14 @@ if __name__ == "__main__":
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    for filename in sorted(os.listdir(input_dir)):
-        if filename.lower().endswith(".pdf"):
-            input_path = os.path.join(input_dir, filename)
+    pdf_files = [f for f in sorted(os.listdir(input_dir)) if f.lower().endswith(".pdf")]
+    input_paths = [os.path.join(input_dir, f) for f in pdf_files]
+
+    # Each PDF is independent and CPU-bound, so process them in parallel
+    with ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, 4)) as executor:
+        for filename, result in zip(pdf_files, executor.map(process_pdf, input_paths, chunksize=1)):
             output_filename = os.path.splitext(filename)[0] + ".json"
             output_path = os.path.join(output_dir, output_filename)
             
-            result = process_pdf(input_path)
-            
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(result, f, indent=4, ensure_ascii=False)
+            write_json(output_path, result)
             print(f" - Saved final output to {output_path}")
\ No newline at end of file